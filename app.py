@@ -9,10 +9,15 @@ Nexso Next Innovation - Single-file Flask app
 - Carpetas automáticas: static/audio, static/imagenes/Tecnologia, static/imagenes/Diseno
 """
 
-from flask import Flask, render_template_string, request, redirect, url_for, send_from_directory, session, flash, jsonify
+from flask import Flask, render_template_string, request, redirect, url_for, send_from_directory, session, flash, jsonify, g, make_response
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-import os, json, time, uuid
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wsgi import FileWrapper
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+import os, re, sys, json, math, time, uuid, gc, heapq, itertools, random, shutil, sqlite3, tempfile, threading, tracemalloc
+from collections import Counter, defaultdict
+from urllib.parse import quote, unquote
+import click
 
 # ---------------- Configuración ----------------
 APP_NAME = "Nexso Next Innovation"
@@ -21,8 +26,27 @@ IMG_BASE = os.path.join(BASE_STATIC, "imagenes")
 AUDIO_DIR = os.path.join(BASE_STATIC, "audio")
 DATA_FILE = "data.json"
 ORDERS_FILE = "orders.json"
+ORDERS_INDEX_FILE = "orders_index.db"
 ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_IMAGE = 16 * 1024 * 1024
+CATALOG_PAGE_SIZE = 48
+EXPORT_DIR = "export"  # sitio estático generado por `flask --app app export-static`
+RATE_DB_FILE = "ratelimit.db"
+RATE_LIMIT_ENABLED = True
+PROXY_FIX_HOPS = 0  # proxies de confianza delante de Flask (1 detrás de nginx): la IP del cliente sale de X-Forwarded-For
+# clase de ruta -> (capacidad del bucket, tokens por segundo), por IP
+RATE_LIMITS = {
+    "publico": (60, 2.0),
+    "costoso": (20, 0.5),   # búsquedas, catálogo completo
+    "imagen": (240, 24.0),  # una página del catálogo pide hasta CATALOG_PAGE_SIZE imágenes de golpe
+    "compra": (30, 1.0),    # carrito, checkout y estado de pedido: nunca compiten con los costosos
+    "login": (10, 0.1),
+}
+MAX_COSTOSOS_CONCURRENTES = 8  # en total, entre todos los workers
+SLOT_TTL = 600                  # un cupo no liberado (worker caído) vence a los 10 minutos
+IMAGEN_GRANDE = 1024 * 1024     # imágenes desde este tamaño también ocupan un cupo de concurrencia
+RELATED_N = 4            # productos relacionados por ficha
+RELATED_MAX_ITEMS = 20   # un pedido con más productos solo cuenta los primeros (los pares crecen al cuadrado)
 
 # Crear carpetas necesarias
 os.makedirs(BASE_STATIC, exist_ok=True)
@@ -34,8 +58,93 @@ for cat in ["Tecnologia", "Diseno"]:
 app = Flask(__name__)
 app.secret_key = "cambia_esta_clave_por_otra_muy_segura"  # cámbiala en producción
 app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS, x_host=PROXY_FIX_HOPS)
+
+# ---------------- Modelo de producto ----------------
+# Separador del listado empaquetado de imágenes: secure_filename nunca deja "/" en un nombre
+IMG_SEP = "/"
+
+def parse_precio(valor):
+    """Valor numérico del precio con la misma regla del carrito (se quitan las comas); None si no es un número."""
+    try:
+        return float(str(valor).replace(',', ''))
+    except ValueError:
+        return None
+
+class Product:
+    """
+    Registro compacto de producto (sin __dict__ por instancia):
+    - categoría internada (una sola copia del texto para todo el catálogo)
+    - precio: el texto del admin tal cual (para mostrar y guardar) y su valor numérico aparte
+    - created entero
+    - imágenes empaquetadas en un único str separado por IMG_SEP
+    Los templates lo usan igual que el dict anterior (p.nombre, p.images, ...);
+    to_dict() produce el mismo formato que data.json y /api/products.
+    """
+    __slots__ = ("id", "nombre", "_precio", "_precio_num", "_categoria", "descripcion", "_images", "created")
+
+    def __init__(self, id, nombre, precio, categoria, descripcion="", images=(), created=0):
+        self.id = id
+        self.nombre = nombre
+        self.precio = precio
+        self.categoria = categoria
+        self.descripcion = descripcion
+        self._images = IMG_SEP.join(images)
+        self.created = int(created or 0)
+
+    @classmethod
+    def from_dict(cls, d, pid=None):
+        # reutiliza la clave del dict de productos como id para no duplicar el uuid
+        return cls(pid if pid is not None else d["id"], d.get("nombre", ""), d.get("precio", "0"),
+                   d.get("categoria", ""), d.get("descripcion", ""), d.get("images", ()), d.get("created", 0))
+
+    def to_dict(self):
+        return {"id": self.id, "nombre": self.nombre, "precio": self.precio, "categoria": self.categoria,
+                "descripcion": self.descripcion, "images": list(self.images), "created": self.created}
+
+    @property
+    def precio(self):
+        return self._precio
+
+    @precio.setter
+    def precio(self, valor):
+        self._precio = valor
+        self._precio_num = parse_precio(valor)
+
+    @property
+    def precio_num(self):
+        if self._precio_num is None:
+            raise ValueError(f"Precio inválido: {self._precio!r}")
+        return self._precio_num
+
+    @property
+    def categoria(self):
+        return self._categoria
+
+    @categoria.setter
+    def categoria(self, valor):
+        self._categoria = sys.intern(str(valor))
+
+    @property
+    def images(self):
+        return tuple(self._images.split(IMG_SEP)) if self._images else ()
+
+    def add_image(self, filename):
+        self._images = self._images + IMG_SEP + filename if self._images else filename
+
+    def remove_image(self, filename):
+        self._images = IMG_SEP.join(im for im in self.images if im != filename)
+
+def _json_default(o):
+    if isinstance(o, Product):
+        return o.to_dict()
+    raise TypeError(f"Objeto no serializable: {type(o).__name__}")
 
 # ---------------- Persistencia ----------------
+_newest_by_cat = {}  # categoria -> pids más nuevos (respaldo de related_products)
+_products_json = {}  # "body" -> bytes de /api/products, se invalida en save_data
+
 def load_data():
     if not os.path.exists(DATA_FILE):
         default = {
@@ -55,11 +164,16 @@ def load_data():
         }
         save_data(default)
     with open(DATA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+        d = json.load(f)
+    d["products"] = {pid: Product.from_dict(p, pid) for pid, p in d.get("products", {}).items()}
+    return d
 
 def save_data(d):
     with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(d, f, ensure_ascii=False, indent=2)
+        json.dump(d, f, ensure_ascii=False, indent=2, default=_json_default)
+    # el catálogo cambió: recalcular el respaldo de recomendaciones y el JSON de /api/products
+    _newest_by_cat.clear()
+    _products_json.clear()
 
 def load_orders():
     if not os.path.exists(ORDERS_FILE):
@@ -69,13 +183,249 @@ def load_orders():
         return json.load(f)
 
 def save_order(o):
-    orders = load_orders()
-    orders.append(o)
-    with open(ORDERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(orders, f, ensure_ascii=False, indent=2)
+    """
+    Agrega el pedido al final del array de orders.json sin releer el historial
+    y registra su posición (offset, longitud) en el índice SQLite.
+    BEGIN IMMEDIATE serializa las escrituras entre workers.
+    """
+    if not os.path.exists(ORDERS_FILE):
+        load_orders()
+    con = _orders_db()
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        _refresh_order_index(con)
+        with open(ORDERS_FILE, "r+b") as f:
+            offset, length, size = _append_order_raw(f, o)
+        con.execute("INSERT OR REPLACE INTO pedidos VALUES (?, ?, ?, ?)",
+                    (o["id"], _norm_tel(o.get("cliente", {}).get("telefono", "")), offset, length))
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('size', ?)", (size,))
+        update_related(con, _order_pids(o))
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+# ---------------- Índice de pedidos ----------------
+# orders.json sigue siendo la fuente de verdad; orders_index.db solo guarda dónde empieza
+# cada pedido (id -> offset, longitud en bytes) y se puede regenerar en cualquier momento.
+_JSON_SKIP = re.compile(r'[\s,]*')
+
+def _orders_db():
+    con = sqlite3.connect(ORDERS_INDEX_FILE, timeout=30, isolation_level=None)
+    con.execute("CREATE TABLE IF NOT EXISTS pedidos (id TEXT PRIMARY KEY, telefono TEXT, offset INTEGER, length INTEGER)")
+    con.execute("CREATE INDEX IF NOT EXISTS pedidos_telefono ON pedidos(telefono)")
+    con.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v INTEGER)")
+    _related_schema(con)
+    return con
+
+def _norm_tel(telefono):
+    return "".join(ch for ch in str(telefono) if ch.isdigit())
+
+def _append_order_raw(f, o):
+    # mismo formato que json.dump(orders, indent=2): reemplaza el "]" final por ",\n  {...}\n]"
+    elem = json.dumps(o, ensure_ascii=False, indent=2).replace("\n", "\n  ").encode("utf-8")
+    f.seek(0, 2)
+    tail_start = max(0, f.tell() - 4096)
+    f.seek(tail_start)
+    tail = f.read()
+    end = tail.rfind(b"]")
+    if end < 0:
+        raise ValueError(f"{ORDERS_FILE} no es un array JSON")
+    body = tail[:end].rstrip()
+    prefix = b"\n  " if body.endswith(b"[") else b",\n  "
+    f.seek(tail_start + len(body))
+    f.write(prefix + elem + b"\n]")
+    f.truncate()
+    return tail_start + len(body) + len(prefix), len(elem), f.tell()
+
+def rebuild_order_index(con=None, relacionados=False):
+    """
+    Regenera el índice recorriendo orders.json una vez. Con relacionados=True recalcula en la misma
+    pasada la matriz de co-compra; si no, la marca como desactualizada (meta 'related_stale') para que
+    la reconstruya `flask --app app rebuild-relacionados` fuera del camino de las peticiones.
+    Devuelve la cantidad de pedidos indexados.
+    """
+    own = con is None
+    if own:
+        con = _orders_db()
+        con.execute("BEGIN IMMEDIATE")
+    try:
+        load_orders()  # crea el archivo si no existe
+        with open(ORDERS_FILE, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        dec = json.JSONDecoder()
+        rows = []
+        def pid_lists():
+            i = text.index("[") + 1
+            cur, bcur = 0, 0
+            while True:
+                i = _JSON_SKIP.match(text, i).end()
+                if i >= len(text) or text[i] == "]":
+                    return
+                obj, end = dec.raw_decode(text, i)
+                bstart = bcur + len(text[cur:i].encode("utf-8"))
+                blen = len(text[i:end].encode("utf-8"))
+                rows.append((obj.get("id"), _norm_tel(obj.get("cliente", {}).get("telefono", "")), bstart, blen))
+                cur, bcur, i = end, bstart + blen, end
+                yield _order_pids(obj) if relacionados else ()
+        matrix = build_copurchase(pid_lists())
+        con.execute("DELETE FROM pedidos")
+        con.executemany("INSERT OR REPLACE INTO pedidos VALUES (?, ?, ?, ?)", rows)
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('size', ?)", (os.path.getsize(ORDERS_FILE),))
+        if relacionados:
+            _store_related(con, matrix)
+        # sin pedidos ni matriz previa no hay nada que recalcular (primer arranque)
+        stale = not relacionados and (rows or con.execute("SELECT 1 FROM copurchase LIMIT 1").fetchone())
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('related_stale', ?)", (1 if stale else 0,))
+        if own:
+            con.execute("COMMIT")
+        return len(rows)
+    finally:
+        if own:
+            con.close()
+
+def _refresh_order_index(con):
+    # O(1): solo compara el tamaño de orders.json con el registrado en la última escritura
+    row = con.execute("SELECT v FROM meta WHERE k = 'size'").fetchone()
+    size = os.path.getsize(ORDERS_FILE) if os.path.exists(ORDERS_FILE) else None
+    if row is None or row[0] != size:
+        rebuild_order_index(con)
+
+def _read_orders_at(rows):
+    out = []
+    with open(ORDERS_FILE, "rb") as f:
+        for offset, length in rows:
+            f.seek(offset)
+            out.append(json.loads(f.read(length).decode("utf-8")))
+    return out
+
+_orders_local = threading.local()
+
+def _orders_reader():
+    # conexión de solo lectura por hilo, sin DDL: las consultas públicas son un SELECT por clave.
+    # El esquema solo se crea en las rutas de escritura (_orders_db).
+    con = getattr(_orders_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(f"file:{quote(os.path.abspath(ORDERS_INDEX_FILE))}?mode=ro", uri=True)
+        _orders_local.con = con
+    return con
+
+def _index_query(sql, args):
+    try:
+        row = _orders_reader().execute("SELECT v FROM meta WHERE k = 'size'").fetchone()
+    except sqlite3.Error:
+        row = None  # todavía no existe orders_index.db
+    if not os.path.exists(ORDERS_FILE) or row is None or row[0] != os.path.getsize(ORDERS_FILE):
+        con = _orders_db()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            _refresh_order_index(con)
+            con.execute("COMMIT")
+        finally:
+            con.close()
+    return _orders_reader().execute(sql, args).fetchall()
+
+def get_order(oid):
+    rows = _index_query("SELECT offset, length FROM pedidos WHERE id = ?", (oid,))
+    if not rows:
+        return None
+    o = _read_orders_at(rows)[0]
+    return o if o.get("id") == oid else None
+
+def find_orders_by_phone(telefono):
+    tel = _norm_tel(telefono)
+    if not tel:
+        return []
+    return _read_orders_at(_index_query("SELECT offset, length FROM pedidos WHERE telefono = ? ORDER BY offset", (tel,)))
 
 DATA = load_data()
 
+# ---------------- Recomendaciones ----------------
+# Matriz dispersa de co-compra (a, b) -> cantidad de pedidos con ambos productos, en orders_index.db
+# junto al índice de pedidos. Cada save_order la actualiza en la misma transacción y recalcula el
+# top-N de los productos del pedido, así producto() solo lee una fila de `relacionados`.
+# Si orders.json cambia por fuera, la petición que lo detecta solo regenera el índice de pedidos
+# (la matriz tarda segundos con historiales grandes) y la deja marcada para rebuild-relacionados.
+def _related_schema(con):
+    con.execute("CREATE TABLE IF NOT EXISTS copurchase (a TEXT, b TEXT, n INTEGER, PRIMARY KEY (a, b)) WITHOUT ROWID")
+    con.execute("CREATE INDEX IF NOT EXISTS copurchase_top ON copurchase(a, n DESC)")
+    con.execute("CREATE TABLE IF NOT EXISTS relacionados (pid TEXT PRIMARY KEY, ids TEXT)")
+
+def _order_pids(o):
+    pids = (it.get("product", {}).get("id") for it in o.get("items", []))
+    return list(dict.fromkeys(pid for pid in pids if pid))[:RELATED_MAX_ITEMS]
+
+def update_related(con, pids):
+    """Suma un pedido a la matriz (dentro de la transacción de `con`). Devuelve los pids cuyo top-N se recalculó."""
+    if len(pids) < 2:
+        return []
+    con.executemany("INSERT INTO copurchase VALUES (?, ?, 1) ON CONFLICT(a, b) DO UPDATE SET n = n + 1",
+                    [(a, b) for a in pids for b in pids if a != b])
+    for a in pids:
+        ids = [r[0] for r in con.execute("SELECT b FROM copurchase WHERE a = ? ORDER BY n DESC, b LIMIT ?", (a, RELATED_N))]
+        con.execute("INSERT OR REPLACE INTO relacionados VALUES (?, ?)", (a, " ".join(ids)))
+    return pids
+
+def build_copurchase(pid_lists):
+    """Matriz de co-compra en memoria a partir de listas de pids por pedido: {a: Counter({b: n})}."""
+    matrix = defaultdict(Counter)
+    for pids in pid_lists:
+        for a in pids:
+            row = matrix[a]
+            for b in pids:
+                if a != b:
+                    row[b] += 1
+    return matrix
+
+def top_related(matrix, n=RELATED_N):
+    # mismo orden que update_related (ORDER BY n DESC, b): más co-compras primero, empate por pid menor
+    return {a: [b for b, _ in heapq.nsmallest(n, row.items(), key=lambda kv: (-kv[1], kv[0]))] for a, row in matrix.items()}
+
+def _store_related(con, matrix):
+    con.execute("DELETE FROM copurchase")
+    con.execute("DELETE FROM relacionados")
+    con.executemany("INSERT INTO copurchase VALUES (?, ?, ?)", ((a, b, n) for a, row in matrix.items() for b, n in row.items()))
+    con.executemany("INSERT INTO relacionados VALUES (?, ?)", ((a, " ".join(ids)) for a, ids in top_related(matrix).items()))
+
+def rebuild_related():
+    """Recalcula índice, matriz y relacionados desde orders.json. Devuelve (pedidos, productos con relacionados)."""
+    con = _orders_db()
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        pedidos = rebuild_order_index(con, relacionados=True)
+        productos = con.execute("SELECT COUNT(*) FROM relacionados").fetchone()[0]
+        con.execute("COMMIT")
+        return pedidos, productos
+    finally:
+        con.close()
+
+def related_is_stale():
+    try:
+        row = _orders_reader().execute("SELECT v FROM meta WHERE k = 'related_stale'").fetchone()
+    except sqlite3.Error:
+        return False
+    return bool(row and row[0])
+
+def _newest_in_category(cat):
+    if cat not in _newest_by_cat:
+        prods = [p for p in product_list() if p.categoria == cat]
+        _newest_by_cat[cat] = [p.id for p in heapq.nlargest(RELATED_N + 1, prods, key=lambda p: p.created)]
+    return _newest_by_cat[cat]
+
+def related_products(p):
+    """Top-N precalculado de co-compra; se completa con lo más nuevo de la misma categoría."""
+    try:
+        row = _orders_reader().execute("SELECT ids FROM relacionados WHERE pid = ?", (p.id,)).fetchone()
+    except sqlite3.Error:
+        row = None  # todavía no hay índice (ningún pedido guardado)
+    out = []
+    for pid in (row[0].split() if row else []) + _newest_in_category(p.categoria):
+        r = get_product(pid)
+        if r and r.id != p.id and r not in out:
+            out.append(r)
+            if len(out) == RELATED_N:
+                break
+    return out
+
 # ---------------- Utilidades ----------------
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
@@ -89,6 +439,13 @@ def product_list():
 def get_product(pid):
     return DATA.get("products", {}).get(pid)
 
+def products_json():
+    """Catálogo serializado una sola vez por versión de DATA; cada producto se convierte y se descarta enseguida."""
+    if "body" not in _products_json:
+        parts = (json.dumps(p, default=_json_default, sort_keys=True) for p in product_list())
+        _products_json["body"] = ("[" + ",".join(parts) + "]").encode("utf-8")
+    return _products_json["body"]
+
 def save_uploaded_image(file_storage, category):
     filename_raw = secure_filename(file_storage.filename)
     timestamp = str(int(time.time()))
@@ -100,6 +457,174 @@ def save_uploaded_image(file_storage, category):
     file_storage.save(path)
     return filename
 
+# ---------------- Control de admisión ----------------
+# Token bucket por IP y clase de ruta y cupos de concurrencia para las rutas costosas, ambos en
+# SQLite (compartido entre workers). Un cupo se libera cuando el servidor termina de enviar la
+# respuesta, no al salir de la vista. Lo rechazado responde rápido con 429/503 + Retry-After.
+# Detrás de nginx hay que poner PROXY_FIX_HOPS = 1; si no, todos los clientes comparten el bucket de 127.0.0.1.
+ROUTE_CLASSES = {
+    'catalog': 'costoso', 'categoria': 'costoso', 'api_products': 'costoso', 'serve_image': 'imagen',
+    'add_to_cart': 'compra', 'cart': 'compra', 'checkout': 'compra', 'pedido': 'compra', 'api_pedido': 'compra',
+    'admin': 'login',
+}
+_rate_local = threading.local()
+
+def _rate_db():
+    con = getattr(_rate_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(RATE_DB_FILE, timeout=1, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=OFF")
+        con.execute("CREATE TABLE IF NOT EXISTS buckets (k TEXT PRIMARY KEY, tokens REAL, ts REAL)")
+        con.execute("CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, ts REAL)")
+        _rate_local.con = con
+        _rate_local.calls = 0
+    return con
+
+def take_token(key, capacidad, por_seg):
+    """Consume un token del bucket `key`. Devuelve 0 si se admite o los segundos hasta el próximo token."""
+    now = time.time()
+    con = _rate_db()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        row = con.execute("SELECT tokens, ts FROM buckets WHERE k = ?", (key,)).fetchone()
+        tokens = capacidad if row is None else min(capacidad, row[0] + (now - row[1]) * por_seg)
+        espera = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            espera = (1 - tokens) / por_seg
+        con.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, tokens, now))
+        _rate_local.calls += 1
+        if _rate_local.calls % 1000 == 0:
+            # un bucket sin uso por una hora ya está lleno: equivale a no tener fila
+            con.execute("DELETE FROM buckets WHERE ts < ?", (now - 3600,))
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return espera
+
+def acquire_slot():
+    """Reserva un cupo global para una ruta costosa. Devuelve el id del cupo o None si están todos ocupados."""
+    now = time.time()
+    con = _rate_db()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute("DELETE FROM slots WHERE ts < ?", (now - SLOT_TTL,))
+        if con.execute("SELECT COUNT(*) FROM slots").fetchone()[0] >= MAX_COSTOSOS_CONCURRENTES:
+            con.execute("COMMIT")
+            return None
+        slot = uuid.uuid4().hex
+        con.execute("INSERT INTO slots VALUES (?, ?)", (slot, now))
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return slot
+
+def release_slot(slot):
+    try:
+        _rate_db().execute("DELETE FROM slots WHERE id = ?", (slot,))
+    except sqlite3.Error:
+        pass  # vence solo después de SLOT_TTL
+
+class _SlotFile:
+    """Archivo servido con un cupo tomado: lo libera cuando el servidor lo cierra tras enviarlo."""
+    def __init__(self, f, slot):
+        self._f = f
+        self._slot = slot
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)  # fileno/seek/tell siguen disponibles para sendfile
+
+    def close(self):
+        try:
+            self._f.close()
+        finally:
+            if self._slot:
+                release_slot(self._slot)
+                self._slot = None
+
+def _hand_slot_to_file(slot):
+    # send_file crea su iterable con environ['wsgi.file_wrapper']: se intercepta solo la creación,
+    # así la respuesta conserva el tipo del servidor y gunicorn/uWSGI pueden seguir usando sendfile
+    environ = request.environ
+    original = environ.get('wsgi.file_wrapper')
+    server_wrapper = original or FileWrapper
+    def wrapper(f, buffer_size=8192):
+        g.slot_en_archivo = True
+        return server_wrapper(_SlotFile(f, slot), buffer_size)
+    g.file_wrapper_original = original
+    environ['wsgi.file_wrapper'] = wrapper
+
+def _restore_file_wrapper():
+    if 'file_wrapper_original' in g:
+        original = g.pop('file_wrapper_original')
+        if original is None:
+            request.environ.pop('wsgi.file_wrapper', None)
+        else:
+            request.environ['wsgi.file_wrapper'] = original
+
+def _is_large_image():
+    path = safe_join(IMG_BASE, request.view_args.get('categoria', ''), request.view_args.get('filename', ''))
+    try:
+        return path is not None and os.path.getsize(path) >= IMAGEN_GRANDE
+    except OSError:
+        return False
+
+def _shed(status, espera, mensaje):
+    if request.path.startswith('/api/'):
+        resp = make_response(jsonify({"error": mensaje}), status)
+    else:
+        resp = make_response(mensaje, status)
+    resp.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return resp
+
+@app.before_request
+def admission_control():
+    if not RATE_LIMIT_ENABLED or 'admin_user' in session:
+        return  # el admin autenticado tiene prioridad total
+    clase = ROUTE_CLASSES.get(request.endpoint, 'publico')
+    capacidad, por_seg = RATE_LIMITS[clase]
+    pesada = clase == 'costoso' or (clase == 'imagen' and _is_large_image())
+    ocupado = "Servidor ocupado, intenta de nuevo en unos segundos"
+    try:
+        espera = take_token(f"{request.remote_addr or '-'}|{clase}", capacidad, por_seg)
+    except sqlite3.Error:
+        # almacén bloqueado = carga alta: las rutas pesadas se rechazan, el resto sigue sin límite
+        if pesada:
+            return _shed(503, 1, ocupado)
+        espera = 0
+    if espera:
+        return _shed(429, espera, "Demasiadas solicitudes, intenta de nuevo en unos segundos")
+    if pesada:
+        try:
+            slot = acquire_slot()
+        except sqlite3.Error:
+            return _shed(503, 1, ocupado)
+        if slot is None:
+            return _shed(503, 1, ocupado)
+        g.slot = slot
+        _hand_slot_to_file(slot)
+
+@app.after_request
+def _hold_slot_until_sent(response):
+    # el cuerpo se transmite después del teardown: el cupo se suelta al cerrar la respuesta
+    # (o el archivo, si send_file lo envolvió en _SlotFile)
+    _restore_file_wrapper()  # el servidor compara la respuesta con su propio wsgi.file_wrapper
+    slot = g.pop('slot', None)
+    if slot and not g.pop('slot_en_archivo', False):
+        response.call_on_close(lambda: release_slot(slot))
+    return response
+
+@app.teardown_request
+def _release_admission(exc):
+    _restore_file_wrapper()
+    slot = g.pop('slot', None)  # solo si la respuesta nunca llegó a after_request
+    if slot:
+        release_slot(slot)
+
 # ---------------- Rutas estáticas ----------------
 @app.route('/static/imagenes/<categoria>/<filename>')
 def serve_image(categoria, filename):
@@ -247,6 +772,8 @@ header{padding:12px;background:#111;display:flex;align-items:center;justify-cont
 .price{font-weight:800;color:var(--gold)}
 .footer{padding:14px;text-align:center;color:rgba(255,255,255,0.7)}
 .btn-new{background:var(--gold);color:#000;padding:8px 12px;border-radius:8px;border:none;cursor:pointer}
+.pager{display:flex;gap:12px;justify-content:center;align-items:center;margin-top:18px}
+.pager a{color:var(--gold);font-weight:800;text-decoration:none}
 </style>
 </head><body>
 <header>
@@ -285,6 +812,13 @@ header{padding:12px;background:#111;display:flex;align-items:center;justify-cont
     {% endfor %}
   </div>
 
+  {% if paginas > 1 %}
+  <div class="pager">
+    {% if pagina > 1 %}<a href="{{ url_for('catalog', pagina=pagina-1, q=request.args.get('q') or None, categoria=request.args.get('categoria') or None) }}">← Anterior</a>{% endif %}
+    <span>Página {{ pagina }} de {{ paginas }}</span>
+    {% if pagina < paginas %}<a href="{{ url_for('catalog', pagina=pagina+1, q=request.args.get('q') or None, categoria=request.args.get('categoria') or None) }}">Siguiente →</a>{% endif %}
+  </div>
+  {% endif %}
 </div>
 <footer class="footer">© {{ year }} {{ site.titulo }}</footer>
 </body></html>
@@ -301,6 +835,9 @@ body{margin:0;font-family:Inter,Arial;background:#0b0b0b;color:#fff}
 @media(max-width:800px){ .gallery img{width:100%} }
 .price{font-weight:900;color:#ffd700;font-size:1.4rem;margin-top:8px}
 .btn{background:#ffd700;border:none;padding:10px 14px;border-radius:8px;font-weight:800;cursor:pointer}
+.related{display:grid;grid-template-columns:repeat(auto-fit,minmax(180px,1fr));gap:12px}
+.related a{background:#0f0f0f;padding:10px;border-radius:8px;color:#fff;text-decoration:none}
+.related img{width:100%;height:120px;object-fit:cover;border-radius:6px}
 </style>
 </head><body>
 <div class="wrap">
@@ -323,6 +860,39 @@ body{margin:0;font-family:Inter,Arial;background:#0b0b0b;color:#fff}
   <div style="margin-top:18px">
     <a class="btn" href="{{ url_for('editar_producto', pid=p.id) }}">Editar producto (Admin)</a>
   </div>
+
+  {% if relacionados is none %}
+  <!-- página exportada: los relacionados cambian con cada pedido, se piden a Flask -->
+  <div id="relacionados"></div>
+  <script>
+  fetch("{{ url_for('api_relacionados', pid=p.id) }}").then(r => r.ok ? r.json() : []).then(items => {
+    if(!items.length) return;
+    const box = document.getElementById('relacionados');
+    const h = document.createElement('h3'); h.style.cssText = 'color:#ffd700;margin-top:24px';
+    h.textContent = 'También te puede interesar'; box.appendChild(h);
+    const grid = document.createElement('div'); grid.className = 'related'; box.appendChild(grid);
+    for(const it of items){
+      const a = document.createElement('a'); a.href = it.url;
+      if(it.imagen){ const img = document.createElement('img'); img.src = it.imagen; img.alt = ''; a.appendChild(img); }
+      const n = document.createElement('div'); n.textContent = it.nombre; a.appendChild(n);
+      const pr = document.createElement('div'); pr.style.cssText = 'color:#ffd700;font-weight:800';
+      pr.textContent = '$' + it.precio; a.appendChild(pr);
+      grid.appendChild(a);
+    }
+  }).catch(() => {});
+  </script>
+  {% elif relacionados %}
+  <h3 style="color:#ffd700;margin-top:24px">También te puede interesar</h3>
+  <div class="related">
+    {% for r in relacionados %}
+      <a href="{{ url_for('producto', pid=r.id) }}">
+        {% if r.images %}<img src="{{ url_for('serve_image', categoria=r.categoria, filename=r.images[0]) }}" alt="">{% endif %}
+        <div>{{ r.nombre }}</div>
+        <div style="color:#ffd700;font-weight:800">${{ r.precio }}</div>
+      </a>
+    {% endfor %}
+  </div>
+  {% endif %}
 </div>
 </body></html>
 """
@@ -394,6 +964,7 @@ ADMIN_PANEL_HTML = """
   <div class="section">
     <h3>Pedidos</h3>
     <p><a style="color:#ffd700" href="{{ url_for('ver_pedidos') }}">Ver pedidos</a></p>
+    {% if relacionados_desactualizados %}<p style="color:#f66">orders.json cambió por fuera: los productos relacionados están desactualizados. Ejecuta <code>flask --app app rebuild-relacionados</code>.</p>{% endif %}
   </div>
 </div>
 </body></html>
@@ -436,6 +1007,10 @@ ORDERS_HTML = """
 <div class="wrap">
   <h2 style="color:#ffd700">Pedidos registrados</h2>
   <p><a href="{{ url_for('admin') }}" style="color:#fff">← Volver al admin</a></p>
+  <form method="get" action="{{ url_for('ver_pedidos') }}" style="margin-bottom:12px">
+    <input name="telefono" placeholder="Buscar por teléfono" value="{{ request.args.get('telefono','') }}" style="padding:8px;border-radius:8px;border:none">
+    <button style="padding:8px;border-radius:8px;border:none;background:#ffd700;font-weight:800">Buscar</button>
+  </form>
   {% for o in orders %}
     <div class="order">
       <div><strong>ID:</strong> {{ o.id }} — <small>{{ o.time }}</small></div>
@@ -443,7 +1018,7 @@ ORDERS_HTML = """
       <div><strong>Dirección:</strong> {{ o.cliente.direccion }}</div>
       <div><strong>Total:</strong> ${{ "%.2f"|format(o.total) }}</div>
       <div><strong>Items:</strong>
-        <ul>{% for it in o.items %}<li>{{ it.qty }} × {{ it.product.nombre }} — ${{ "%.2f"|format(it.subtotal) }}</li>{% endfor %}</ul>
+        <ul>{% for it in o['items'] %}<li>{{ it.qty }} × {{ it.product.nombre }} — ${{ "%.2f"|format(it.subtotal) }}</li>{% endfor %}</ul>
       </div>
     </div>
   {% else %}
@@ -453,35 +1028,60 @@ ORDERS_HTML = """
 </body></html>
 """
 
+ORDER_STATUS_HTML = """
+<!doctype html><html lang="es"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
+<title>Pedido - {{ site.titulo }}</title>
+<style>body{background:#070707;color:#fff;font-family:Inter,Arial;padding:12px}.wrap{max-width:800px;margin:auto}.order{background:#0f0f0f;padding:12px;border-radius:8px}</style></head><body>
+<div class="wrap">
+  <h2 style="color:#ffd700">Estado de tu pedido</h2>
+  <div class="order">
+    <div><strong>ID:</strong> {{ o.id }} — <small>{{ o.time }}</small></div>
+    <div><strong>Estado:</strong> {{ o.estado or "Registrado" }}</div>
+    <div><strong>Cliente:</strong> {{ o.cliente.nombre }}</div>
+    <div><strong>Total:</strong> ${{ "%.2f"|format(o.total) }}</div>
+    <div><strong>Items:</strong>
+      <ul>{% for it in o['items'] %}<li>{{ it.qty }} × {{ it.product.nombre }} — ${{ "%.2f"|format(it.subtotal) }}</li>{% endfor %}</ul>
+    </div>
+  </div>
+  <p><a href="{{ url_for('index') }}" style="color:#fff">Volver al sitio</a></p>
+</div>
+</body></html>
+"""
+
 # ---------------- Rutas públicas ----------------
 @app.route('/')
 def index():
     tech_preview = None
     diseno_preview = None
     for p in product_list():
-        if p['categoria'] == "Tecnologia" and not tech_preview and p.get('images'):
-            tech_preview = url_for('serve_image', categoria="Tecnologia", filename=p['images'][0])
-        if p['categoria'] == "Diseno" and not diseno_preview and p.get('images'):
-            diseno_preview = url_for('serve_image', categoria="Diseno", filename=p['images'][0])
+        if p.categoria == "Tecnologia" and not tech_preview and p.images:
+            tech_preview = url_for('serve_image', categoria="Tecnologia", filename=p.images[0])
+        if p.categoria == "Diseno" and not diseno_preview and p.images:
+            diseno_preview = url_for('serve_image', categoria="Diseno", filename=p.images[0])
     return render_template_string(INDEX_HTML, site=DATA['site'], tech_preview=tech_preview, diseno_preview=diseno_preview, year=time.localtime().tm_year)
 
-@app.route('/catalog')
-def catalog():
+@app.route('/catalog', defaults={'pagina': 1})
+@app.route('/catalog/pagina/<int:pagina>')
+def catalog(pagina):
     q = request.args.get('q','').strip().lower()
     cat = request.args.get('categoria','')
     productos = product_list()
     if q:
-        productos = [p for p in productos if q in (p['nombre'].lower() + p['descripcion'].lower())]
+        productos = [p for p in productos if q in (p.nombre.lower() + p.descripcion.lower())]
     if cat:
-        productos = [p for p in productos if p['categoria'] == cat]
-    return render_template_string(CATALOG_HTML, productos=productos, site=DATA['site'], categories=DATA.get('categories', ["Tecnologia","Diseno"]), year=time.localtime().tm_year, request=request)
+        productos = [p for p in productos if p.categoria == cat]
+    paginas = max(1, math.ceil(len(productos) / CATALOG_PAGE_SIZE))
+    if pagina < 1 or pagina > paginas:
+        return "Página no encontrada", 404
+    productos = productos[(pagina - 1) * CATALOG_PAGE_SIZE:pagina * CATALOG_PAGE_SIZE]
+    return render_template_string(CATALOG_HTML, productos=productos, pagina=pagina, paginas=paginas, site=DATA['site'], categories=DATA.get('categories', ["Tecnologia","Diseno"]), year=time.localtime().tm_year, request=request)
 
 @app.route('/categoria/<nombre>')
 def categoria(nombre):
     folder = os.path.join(IMG_BASE, nombre)
     if not os.path.exists(folder):
         return "Categoría no encontrada", 404
-    productos = [p for p in product_list() if p['categoria'] == nombre]
+    productos = [p for p in product_list() if p.categoria == nombre]
     imgs = [f for f in os.listdir(folder) if f.lower().endswith(tuple(ALLOWED_EXT))]
     # render custom category view (simple)
     return render_template_string("""
@@ -523,7 +1123,17 @@ def categoria(nombre):
 def producto(pid):
     p = get_product(pid)
     if not p: return "Producto no encontrado", 404
-    return render_template_string(PRODUCT_HTML, p=p, site=DATA['site'])
+    # en la exportación estática los relacionados se cargan desde /api/relacionados
+    relacionados = None if g.get('exportando') else related_products(p)
+    return render_template_string(PRODUCT_HTML, p=p, relacionados=relacionados, site=DATA['site'])
+
+@app.route('/api/relacionados/<pid>')
+def api_relacionados(pid):
+    p = get_product(pid)
+    if not p: return jsonify({"error": "Producto no encontrado"}), 404
+    return jsonify([{"id": r.id, "nombre": r.nombre, "precio": r.precio, "url": url_for('producto', pid=r.id),
+                     "imagen": url_for('serve_image', categoria=r.categoria, filename=r.images[0]) if r.images else None}
+                    for r in related_products(p)])
 
 # ---------------- Carrito ----------------
 @app.route('/add_to_cart/<pid>', methods=['POST'])
@@ -543,9 +1153,8 @@ def cart():
     for pid, qty in cart.items():
         p = get_product(pid)
         if not p: continue
-        price = float(str(p['precio']).replace(',',''))
-        subtotal = price * qty
-        items.append({'product':p, 'qty':qty, 'subtotal':subtotal})
+        subtotal = p.precio_num * qty
+        items.append({'product':p.to_dict(), 'qty':qty, 'subtotal':subtotal})
         total += subtotal
     # simple template
     html = "<h2 style='color:#ffd700'>Carrito</h2>"
@@ -568,9 +1177,8 @@ def checkout():
     for pid, qty in cart.items():
         p = get_product(pid)
         if not p: continue
-        price = float(str(p['precio']).replace(',',''))
-        subtotal = price * qty
-        items.append({'product':p, 'qty':qty, 'subtotal':subtotal})
+        subtotal = p.precio_num * qty
+        items.append({'product':p.to_dict(), 'qty':qty, 'subtotal':subtotal})
         total += subtotal
     if request.method == 'POST':
         nombre = request.form.get('nombre','Cliente')
@@ -581,11 +1189,12 @@ def checkout():
             "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now_ts())),
             "cliente": {"nombre": nombre, "telefono": telefono, "direccion": direccion},
             "items": items,
-            "total": total
+            "total": total,
+            "estado": "Registrado"
         }
         save_order(pedido)
         session['cart'] = {}
-        return f"<h2>Gracias {nombre}, pedido registrado ({pedido['id']}) — Total: ${total:.2f}</h2><p><a href='/'>Volver</a></p>"
+        return f"<h2>Gracias {nombre}, pedido registrado ({pedido['id']}) — Total: ${total:.2f}</h2><p><a href='{url_for('pedido', oid=pedido['id'])}'>Ver estado del pedido</a> · <a href='/'>Volver</a></p>"
     # form
     return """
     <h2 style='color:#ffd700'>Checkout</h2>
@@ -597,6 +1206,24 @@ def checkout():
     </form>
     """
 
+# ---------------- Estado de pedido ----------------
+def _public_order(o):
+    # sin teléfono ni dirección: el id del pedido es lo único que necesita el cliente
+    return {"id": o["id"], "time": o.get("time"), "estado": o.get("estado", "Registrado"),
+            "cliente": {"nombre": o.get("cliente", {}).get("nombre", "")}, "items": o.get("items", []), "total": o.get("total", 0)}
+
+@app.route('/pedido/<oid>')
+def pedido(oid):
+    o = get_order(oid)
+    if not o: return "Pedido no encontrado", 404
+    return render_template_string(ORDER_STATUS_HTML, o=_public_order(o), site=DATA['site'])
+
+@app.route('/api/pedido/<oid>')
+def api_pedido(oid):
+    o = get_order(oid)
+    if not o: return jsonify({"error": "Pedido no encontrado"}), 404
+    return jsonify(_public_order(o))
+
 # ---------------- Admin ----------------
 @app.route('/admin', methods=['GET','POST'])
 def admin():
@@ -613,7 +1240,7 @@ def admin():
                 error = "Usuario o contraseña incorrectos"
         return render_template_string(ADMIN_LOGIN_HTML, site=DATA['site'], error=error)
     productos = product_list()
-    return render_template_string(ADMIN_PANEL_HTML, site=DATA['site'], productos=productos, categories=DATA.get('categories', ["Tecnologia","Diseno"]))
+    return render_template_string(ADMIN_PANEL_HTML, site=DATA['site'], productos=productos, categories=DATA.get('categories', ["Tecnologia","Diseno"]), relacionados_desactualizados=related_is_stale())
 
 @app.route('/logout')
 def logout():
@@ -636,9 +1263,10 @@ def crear_producto():
             if f and allowed_file(f.filename):
                 fn = save_uploaded_image(f, categoria)
                 images.append(fn)
-        prod = {"id":pid, "nombre":nombre, "precio":precio, "categoria":categoria, "descripcion":descripcion, "images":images, "created": now_ts()}
+        prod = Product(pid, nombre, precio, categoria, descripcion, images, now_ts())
         DATA.setdefault('products', {})[pid] = prod
         save_data(DATA)
+        refresh_static_export(pids=[pid], categorias=[categoria], paginas=[_catalog_pagina(len(DATA['products']) - 1)])
         return redirect(url_for('admin'))
     return redirect(url_for('admin'))
 
@@ -649,18 +1277,19 @@ def editar_producto(pid):
     p = get_product(pid)
     if not p: return "No encontrado", 404
     if request.method == 'POST':
-        p['nombre'] = request.form.get('nombre', p['nombre'])
-        p['precio'] = request.form.get('precio', p['precio'])
-        new_cat = request.form.get('categoria', p['categoria'])
+        old_cat = p.categoria
+        p.nombre = request.form.get('nombre', p.nombre)
+        p.precio = request.form.get('precio', p.precio)
+        new_cat = request.form.get('categoria', p.categoria)
         if new_cat and new_cat not in DATA.get('categories', []):
             DATA.setdefault('categories', []).append(new_cat)
             os.makedirs(os.path.join(IMG_BASE, new_cat), exist_ok=True)
         # if category changed, move images
-        if new_cat != p['categoria']:
-            old_dir = os.path.join(IMG_BASE, p['categoria'])
+        if new_cat != p.categoria:
+            old_dir = os.path.join(IMG_BASE, p.categoria)
             new_dir = os.path.join(IMG_BASE, new_cat)
             os.makedirs(new_dir, exist_ok=True)
-            for img in list(p.get('images', [])):
+            for img in p.images:
                 old_path = os.path.join(old_dir, img)
                 new_path = os.path.join(new_dir, img)
                 try:
@@ -668,14 +1297,15 @@ def editar_producto(pid):
                         os.rename(old_path, new_path)
                 except:
                     pass
-            p['categoria'] = new_cat
-        p['descripcion'] = request.form.get('descripcion', p['descripcion'])
+            p.categoria = new_cat
+        p.descripcion = request.form.get('descripcion', p.descripcion)
         files = request.files.getlist('imagenes')
         for f in files:
             if f and allowed_file(f.filename):
-                fn = save_uploaded_image(f, p['categoria'])
-                p['images'].append(fn)
+                fn = save_uploaded_image(f, p.categoria)
+                p.add_image(fn)
         save_data(DATA)
+        refresh_static_export(pids=[pid], categorias={old_cat, p.categoria}, paginas=[_catalog_pagina(list(DATA['products']).index(pid))])
         return redirect(url_for('admin'))
     return render_template_string(EDIT_PRODUCT_HTML, p=p, categories=DATA.get('categories', ["Tecnologia","Diseno"]))
 
@@ -686,14 +1316,16 @@ def eliminar_producto(pid):
     p = get_product(pid)
     if not p:
         return redirect(url_for('admin'))
-    for im in p.get('images', []):
-        path = os.path.join(IMG_BASE, p['categoria'], im)
+    for im in p.images:
+        path = os.path.join(IMG_BASE, p.categoria, im)
         try:
             if os.path.exists(path): os.remove(path)
         except:
             pass
+    pos = list(DATA['products']).index(pid)
     DATA['products'].pop(pid, None)
     save_data(DATA)
+    refresh_static_export(pids=[pid], categorias=[p.categoria], paginas_desde=_catalog_pagina(pos))
     return redirect(url_for('admin'))
 
 @app.route('/eliminar_imagen/<pid>/<filename>', methods=['POST'])
@@ -703,13 +1335,14 @@ def eliminar_imagen(pid, filename):
     p = get_product(pid)
     if not p:
         return redirect(url_for('admin'))
-    if filename in p.get('images', []):
+    if filename in p.images:
         try:
-            os.remove(os.path.join(IMG_BASE, p['categoria'], filename))
+            os.remove(os.path.join(IMG_BASE, p.categoria, filename))
         except:
             pass
-        p['images'].remove(filename)
+        p.remove_image(filename)
         save_data(DATA)
+        refresh_static_export(pids=[pid], categorias=[p.categoria], paginas=[_catalog_pagina(list(DATA['products']).index(pid))])
     return redirect(url_for('editar_producto', pid=pid))
 
 @app.route('/guardar_categorias', methods=['POST'])
@@ -718,23 +1351,138 @@ def guardar_categorias():
         return redirect(url_for('admin'))
     raw = request.form.get('cats','')
     cats = [c.strip() for c in raw.split(',') if c.strip()]
+    old_cats = DATA.get('categories', [])
     DATA['categories'] = cats
     for c in cats:
         os.makedirs(os.path.join(IMG_BASE, c), exist_ok=True)
     save_data(DATA)
+    # el selector de categorías aparece en todas las páginas del catálogo
+    refresh_static_export(categorias=set(old_cats) | set(cats), paginas_desde=1)
     return redirect(url_for('admin'))
 
 @app.route('/ver_pedidos')
 def ver_pedidos():
     if 'admin_user' not in session:
         return redirect(url_for('admin'))
-    orders = load_orders()
+    telefono = request.args.get('telefono', '').strip()
+    orders = find_orders_by_phone(telefono) if telefono else load_orders()
     return render_template_string(ORDERS_HTML, orders=orders, site=DATA['site'])
 
 # API
 @app.route('/api/products')
 def api_products():
-    return jsonify(product_list())
+    return app.response_class(products_json(), mimetype='application/json')
+
+# ---------------- Exportación estática ----------------
+# Las páginas públicas solo dependen de DATA, así que se pueden servir como archivos planos.
+# EXPORT_DIR replica las URLs de Flask (/producto/<pid> -> producto/<pid>/index.html), por ejemplo con nginx:
+#   location /static/ { alias /ruta/a/static/; }
+#   location / {
+#     root /ruta/a/export;
+#     error_page 418 = @flask;
+#     if ($args) { return 418; }   # $uri no incluye la query: /catalog?q=... y ?categoria=... los filtra Flask
+#     try_files $uri $uri/index.html @flask;
+#   }
+#   location @flask { proxy_pass http://127.0.0.1:5000; proxy_set_header X-Forwarded-For $remote_addr; }
+# (con PROXY_FIX_HOPS = 1 para que el control de admisión vea la IP real del cliente)
+# Solo las páginas sin parámetros salen de EXPORT_DIR; catalog.json queda para clientes que busquen en el navegador.
+# Una vez generado el sitio, cada cambio del admin regenera solo las páginas afectadas.
+def _atomic_write(path, data):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)  # nginx ve la versión anterior o la nueva, nunca una a medias
+    except Exception:
+        os.remove(tmp)
+        raise
+
+def _export_path(url_path, filename="index.html"):
+    root = os.path.abspath(EXPORT_DIR)
+    path = os.path.abspath(os.path.join(root, unquote(url_path).strip("/"), filename))
+    if not path.startswith(root + os.sep):
+        raise ValueError(f"Ruta fuera de {EXPORT_DIR}: {url_path}")
+    return path
+
+def _export_page(endpoint, **values):
+    """Renderiza una página pública y la escribe solo si cambió; si ya no existe (404), borra el archivo."""
+    with app.test_request_context():
+        url_path = url_for(endpoint, **values)
+    path = _export_path(url_path)
+    with app.test_request_context(url_path):
+        g.exportando = True
+        resp = app.make_response(app.view_functions[endpoint](**values))
+    if resp.status_code != 200:
+        if os.path.exists(path):
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        return
+    body = resp.get_data()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == body:
+                return
+    _atomic_write(path, body)
+
+def _catalog_pagina(pos):
+    return pos // CATALOG_PAGE_SIZE + 1
+
+def _exported_catalog_pages():
+    pag_dir = os.path.join(EXPORT_DIR, "catalog", "pagina")
+    nums = [int(name) for name in os.listdir(pag_dir) if name.isdigit()] if os.path.isdir(pag_dir) else []
+    return max([1] + nums)
+
+def _export_catalog(paginas=(), desde=None):
+    total = max(1, math.ceil(len(DATA.get('products', {})) / CATALOG_PAGE_SIZE))
+    anterior = _exported_catalog_pages()
+    todas = set(p for p in paginas if 1 <= p <= total)
+    if desde is not None:
+        todas.update(range(max(1, desde), total + 1))
+    if total != anterior:
+        # cada página muestra "Página N de M" y los enlaces Anterior/Siguiente
+        todas = set(range(1, total + 1))
+    for n in sorted(todas):
+        _export_page('catalog', pagina=n)
+    # páginas que sobran cuando el catálogo se achica
+    pag_dir = os.path.join(EXPORT_DIR, "catalog", "pagina")
+    for n in range(total + 1, anterior + 1):
+        shutil.rmtree(os.path.join(pag_dir, str(n)), ignore_errors=True)
+
+def _export_catalog_json():
+    # mismo contenido que /api/products, para búsqueda en el navegador
+    _atomic_write(os.path.join(EXPORT_DIR, "catalog.json"), products_json())
+
+def refresh_static_export(pids=(), categorias=(), paginas=(), paginas_desde=None):
+    """Regenera las páginas estáticas afectadas por un cambio del admin. No hace nada si nunca se exportó."""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    for pid in pids:
+        _export_page('producto', pid=pid)
+    for c in categorias:
+        _export_page('categoria', nombre=c)
+    _export_page('index')
+    _export_catalog(paginas, paginas_desde)
+    _export_catalog_json()
+
+def export_static_site():
+    """Exporta todo el sitio público a EXPORT_DIR y elimina páginas de productos/categorías que ya no existen."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    pids = list(DATA.get('products', {}))
+    cats = DATA.get('categories', ["Tecnologia","Diseno"])
+    refresh_static_export(pids=pids, categorias=cats, paginas_desde=1)
+    for sub, vigentes in (("producto", set(pids)), ("categoria", set(cats))):
+        folder = os.path.join(EXPORT_DIR, sub)
+        if not os.path.isdir(folder): continue
+        for name in os.listdir(folder):
+            if name not in vigentes:
+                shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    return len(pids)
 
 # ---------------- Sincronizar imágenes sueltas a productos si hay archivos existentes ----------------
 def sync_from_existing_images():
@@ -747,25 +1495,126 @@ def sync_from_existing_images():
             if not allowed_file(fname): continue
             found = False
             for p in DATA['products'].values():
-                if fname in p.get('images', []) and p.get('categoria') == cat:
+                if p.categoria == cat and fname in p.images:
                     found = True; break
             if not found:
                 pid = str(uuid.uuid4())
-                DATA['products'][pid] = {
-                    "id": pid,
-                    "nombre": os.path.splitext(fname)[0].replace('_',' ').title(),
-                    "precio": "1200",
-                    "categoria": cat,
-                    "descripcion": "Descripción pendiente...",
-                    "images": [fname],
-                    "created": now_ts()
-                }
+                DATA['products'][pid] = Product(
+                    pid,
+                    os.path.splitext(fname)[0].replace('_',' ').title(),
+                    "1200",
+                    cat,
+                    "Descripción pendiente...",
+                    [fname],
+                    now_ts()
+                )
                 changed = True
     if changed:
         save_data(DATA)
 
 sync_from_existing_images()
 
+# ---------------- Comandos (flask --app app <comando>) ----------------
+@app.cli.command("reindex-pedidos")
+def reindex_pedidos():
+    """Regenera el índice de pedidos de orders_index.db a partir de orders.json."""
+    click.echo(f"pedidos indexados: {rebuild_order_index()}")
+    if related_is_stale():
+        click.echo("relacionados marcados como desactualizados: ejecuta `flask --app app rebuild-relacionados`")
+
+@app.cli.command("export-static")
+def export_static():
+    """Genera el sitio público estático en EXPORT_DIR."""
+    n = export_static_site()
+    click.echo(f"sitio exportado en {EXPORT_DIR}/ ({n} productos)")
+
+@app.cli.command("rebuild-relacionados")
+def rebuild_relacionados():
+    """Recalcula la matriz de co-compra y los relacionados desde orders.json."""
+    pedidos, productos = rebuild_related()
+    click.echo(f"pedidos procesados: {pedidos}, productos con relacionados: {productos}")
+
+# ---------------- Benchmarks (flask --app app <comando>) ----------------
+def _synthetic_products_json(n):
+    cats = DATA.get('categories', ["Tecnologia","Diseno"]) or ["Tecnologia"]
+    prods = {}
+    for i in range(n):
+        pid = str(uuid.uuid4())
+        prods[pid] = {"id": pid, "nombre": f"Producto {i}", "precio": str(1000 + i % 5000), "categoria": cats[i % len(cats)],
+                      "descripcion": "Descripción pendiente...", "images": [f"{1700000000 + i}_{pid[:6]}_foto.jpg"] * (1 + i % 3),
+                      "created": 1700000000 + i}
+    return json.dumps(prods)
+
+@app.cli.command("bench-memoria")
+@click.option("--n", default=100000, show_default=True, help="Cantidad de productos sintéticos")
+def bench_memoria(n):
+    """Compara la memoria del catálogo como dicts (json.load) frente a registros Product."""
+    blob = _synthetic_products_json(n)
+    gc.collect()
+    tracemalloc.start()
+    raw = json.loads(blob)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    compact = {pid: Product.from_dict(p, pid) for pid, p in raw.items()}
+    del raw
+    gc.collect()
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    click.echo(f"productos: {len(compact)}")
+    click.echo(f"dicts:    {dict_bytes / 1048576:.1f} MiB ({dict_bytes / n:.0f} B/producto)")
+    click.echo(f"Product:  {compact_bytes / 1048576:.1f} MiB ({compact_bytes / n:.0f} B/producto)")
+    click.echo(f"ahorro:   {100 * (1 - compact_bytes / dict_bytes):.0f}%")
+
+@app.cli.command("bench-relacionados")
+@click.option("--pedidos", default=1000000, show_default=True, help="Cantidad de pedidos sintéticos")
+@click.option("--productos", default=5000, show_default=True, help="Tamaño del catálogo sintético")
+def bench_relacionados(pedidos, productos):
+    """Escribe un orders.json sintético y mide rebuild-relacionados, save_order y la consulta de relacionados."""
+    global ORDERS_FILE, ORDERS_INDEX_FILE
+    rnd = random.Random(42)
+    prods = [{"id": f"p{i}", "nombre": f"Producto {i}", "precio": str(1000 + i), "categoria": "Tecnologia",
+              "descripcion": "Descripción pendiente...", "images": [f"1700000000_{i:06x}_foto.jpg"], "created": 1700000000 + i}
+             for i in range(productos)]
+    # popularidad tipo Zipf: pocos productos concentran la mayoría de las compras
+    acumulado = list(itertools.accumulate(1 / (i + 1) for i in range(productos)))
+    def pedido(n):
+        elegidos = list({p["id"]: p for p in rnd.choices(prods, cum_weights=acumulado, k=rnd.randint(1, 4))}.values())
+        items = [{"product": p, "qty": 1, "subtotal": float(p["precio"])} for p in elegidos]
+        return {"id": f"{n:032x}", "time": "2025-01-01 12:00:00", "estado": "Registrado",
+                "cliente": {"nombre": "Cliente", "telefono": f"300{n % 10000000:07d}", "direccion": "Calle 1"},
+                "items": items, "total": sum(it["subtotal"] for it in items)}
+    originales = ORDERS_FILE, ORDERS_INDEX_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            ORDERS_FILE = os.path.join(tmp, "orders.json")
+            ORDERS_INDEX_FILE = os.path.join(tmp, "orders_index.db")
+            # mismo formato que deja save_order (array JSON con indent=2)
+            with open(ORDERS_FILE, "w", encoding="utf-8") as f:
+                f.write("[")
+                for n in range(pedidos):
+                    f.write(("\n  " if n == 0 else ",\n  ") + json.dumps(pedido(n), ensure_ascii=False, indent=2).replace("\n", "\n  "))
+                f.write("\n]")
+            tam = os.path.getsize(ORDERS_FILE)
+            t = time.perf_counter()
+            _, con_relacionados = rebuild_related()
+            t_rebuild = time.perf_counter() - t
+            t = time.perf_counter()
+            for n in range(pedidos, pedidos + 1000):
+                save_order(pedido(n))
+            t_save = (time.perf_counter() - t) / 1000
+            con = sqlite3.connect(f"file:{quote(os.path.abspath(ORDERS_INDEX_FILE))}?mode=ro", uri=True)
+            t = time.perf_counter()
+            for p in rnd.choices(prods, k=10000):
+                con.execute("SELECT ids FROM relacionados WHERE pid = ?", (p["id"],)).fetchone()
+            t_lookup = (time.perf_counter() - t) / 10000
+            pares = con.execute("SELECT COUNT(*) FROM copurchase").fetchone()[0]
+            con.close()
+        finally:
+            ORDERS_FILE, ORDERS_INDEX_FILE = originales
+    click.echo(f"pedidos: {pedidos} ({tam / 1048576:.0f} MiB de orders.json), productos: {productos}")
+    click.echo(f"rebuild-relacionados:  {t_rebuild:.1f} s ({con_relacionados} productos, {pares} pares no nulos)")
+    click.echo(f"save_order (con matriz): {t_save * 1e3:.2f} ms")
+    click.echo(f"consulta relacionados: {t_lookup * 1e6:.0f} µs")
+
 # ---------------- Ejecutar ----------------
 if __name__ == '__main__':
     print("🚀 Ejecutando Nexso Next Innovation en http://127.0.0.1:5000")